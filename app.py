@@ -1,9 +1,14 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 from rapidfuzz import process, fuzz
 from pathlib import Path
+import os
+import tempfile
 import colorsys
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 st.set_page_config(page_title="ARG/ARM Risk Lookup", layout="wide", page_icon="🧬")
 
@@ -12,55 +17,224 @@ def clamp01(x):
         x = float(x)
     except:
         return None
+    if x != x:  # NaN
+        return None
     if x < 0: x = 0.0
     if x > 1: x = 1.0
     return x
 
-def risk_color_hex(val):
-    v = clamp01(val)
-    if v is None:
-        return "#455a64"
+def compute_hex(v):
     hue = (1.0 - v) * 120.0 / 360.0  # 120°(green) -> 0°(red)
     l, s = 0.45, 0.7
     r, g, b = colorsys.hls_to_rgb(hue, l, s)
     return "#{:02x}{:02x}{:02x}".format(int(r*255), int(g*255), int(b*255))
 
+# gradient precomputed at 0.01 steps
+HEX_LUT = tuple(compute_hex(i / 100.0) for i in range(101))
+
+def lut_hex(v):
+    # v must already be clamped to [0, 1]
+    return HEX_LUT[int(v * 100 + 0.5)]
+
+def risk_color_hex(val):
+    v = clamp01(val)
+    if v is None:
+        return "#455a64"
+    return lut_hex(v)
+
+NA_BADGE_HTML = '<span style="display:inline-block;padding:4px 10px;border-radius:999px;background:#455a64;color:#fff;">N/A</span>'
+BADGE_TEMPLATE = '<span style="display:inline-block;padding:4px 10px;border-radius:999px;background:{color};color:white;font-weight:600;">{v:.3f}</span>'
+
 def risk_badge_html(val):
     v = clamp01(val)
     if v is None:
-        return '<span style="display:inline-block;padding:4px 10px;border-radius:999px;background:#455a64;color:#fff;">N/A</span>';
-    color = risk_color_hex(v)
-    return f'<span style="display:inline-block;padding:4px 10px;border-radius:999px;background:{color};color:white;font-weight:600;">{v:.3f}</span>'
+        return NA_BADGE_HTML
+    return BADGE_TEMPLATE.format(color=lut_hex(v), v=v)
+
+LEVEL_ORDER = ["Clinical_Importance_level","Transmissibility_level","Mobility_level","Pathogenic_level"]
+SCORE_ORDER = ["Clinial_Importance_score","Transmissbilitty_score","Mobility_score","Pathogenic_score","Final_Risk_score"]
 
-@st.cache_data(show_spinner=False)
-def load_data(path: str) -> pd.DataFrame:
+def sniff_sep(path: str) -> str:
+    with open(path, "rb") as f:
+        head = f.read(4096)
+    return "\t" if head.count(b"\t") > head.count(b",") else ","
+
+def data_version(path: str) -> int:
+    # part of every data-derived cache key, so editing the CSV invalidates them
+    return os.stat(path).st_mtime_ns
+
+# bump when the raw table persisted in the parquet copy changes shape, to invalidate old copies
+PARQUET_FORMAT = "1"
+
+def parquet_source_tag(path: str) -> bytes:
+    # the parquet copy is only valid for this exact CSV (mtime and size) and copy format
+    st_ = os.stat(path)
+    return f"{PARQUET_FORMAT}:{st_.st_mtime_ns}:{st_.st_size}".encode()
+
+def read_parquet_copy(parquet_path: Path, tag: bytes):
     try:
-        d = pd.read_csv(path, low_memory=False)
+        if (pq.read_schema(parquet_path).metadata or {}).get(b"arg_risk_source") != tag:
+            return None
+        return pq.read_table(parquet_path).to_pandas()
     except Exception:
+        return None
+
+def write_parquet_copy(d: pd.DataFrame, parquet_path: Path, tag: bytes):
+    table = pa.Table.from_pandas(d, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"arg_risk_source": tag})
+    tmp = None
+    try:
+        # write beside the target and swap it in, so other sessions never read a half-written file
+        with tempfile.NamedTemporaryFile(dir=parquet_path.parent, prefix=parquet_path.name + ".", suffix=".tmp", delete=False) as f:
+            tmp = f.name
+        pq.write_table(table, tmp)
+        os.replace(tmp, parquet_path)
+    except Exception:
+        # e.g. a read-only deploy; the CSV is simply parsed again next cold start
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_data(path: str, version: int) -> pd.DataFrame:
+    # the parquet copy holds only the raw parsed table; gene_key and dtypes are always derived below
+    parquet_path = Path(path).with_suffix(".parquet")
+    tag = parquet_source_tag(path)
+    d = read_parquet_copy(parquet_path, tag) if parquet_path.exists() else None
+    if d is None:
+        # one multithreaded pyarrow pass with a sniffed delimiter; python-engine sniffing only as a fallback
         try:
-            d = pd.read_csv(path, sep="\t", low_memory=False)
+            d = pd.read_csv(path, sep=sniff_sep(path), engine="pyarrow")
         except Exception:
-            d = pd.read_csv(path, sep=None, engine="python", low_memory=False)
+            d = pd.read_csv(path, sep=None, engine="python")
+        if "Genes" in d.columns:
+            write_parquet_copy(d, parquet_path, tag)
     if "Genes" not in d.columns:
         raise ValueError("Your file must include a 'Genes' column.")
-    d["gene_key"] = d["Genes"].astype(str).str.strip().str.lower()
+    # compact dtypes: arrow-backed strings, int-coded level labels, numeric scores.
+    # Casting Genes first lets strip/lower run as pyarrow compute kernels and yield an arrow column directly.
+    d["Genes"] = d["Genes"].astype("string[pyarrow]")
+    d["gene_key"] = d["Genes"].str.strip().str.lower().fillna("")
+    for c in LEVEL_ORDER:
+        if c in d.columns:
+            d[c] = d[c].astype("category")
+    for c in SCORE_ORDER:
+        if c in d.columns:
+            d[c] = pd.to_numeric(d[c], errors="coerce")
     return d
 
-df = load_data("genes_risk.csv")
+# read-only lookup structures, shared across sessions and reruns without the copy st.cache_data makes;
+# keyed on path and file version (_d is not hashed), so never mutate what this returns
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_indices(path: str, version: int, _d: pd.DataFrame) -> dict:
+    # rapidfuzz choices as an immutable tuple of plain str (not the arrow-backed column)
+    choices = tuple(_d["gene_key"].tolist())
+    # gene_key -> row position (first occurrence wins, like the old .iloc[0] filters)
+    key_index = {}
+    for i, k in enumerate(choices):
+        key_index.setdefault(k, i)
+    # numeric score columns as contiguous float64 arrays for the calculator's gather;
+    # missing / non-numeric scores ("Not Defined") count as 0, resolved once here rather than per compute
+    score_arrays = {}
+    for c in SCORE_ORDER:
+        if c in _d.columns:
+            arr = np.ascontiguousarray(np.nan_to_num(_d[c].to_numpy(dtype=np.float64), nan=0.0))
+            arr.setflags(write=False)
+            score_arrays[c] = arr
+    # column layout: levels first, then scores, then anything else except the internal key
+    present_levels = [c for c in LEVEL_ORDER if c in _d.columns]
+    present_scores = [c for c in SCORE_ORDER if c in _d.columns]
+    base_cols = ["Genes"] + present_levels + present_scores
+    hidden = frozenset(base_cols + ["gene_key"])
+    return {
+        "present_levels": present_levels,
+        "present_scores": present_scores,
+        "display_cols": base_cols + [c for c in _d.columns if c not in hidden],
+        "choices": choices,
+        "key_index": key_index,
+        "score_arrays": score_arrays,
+        "gene_labels": tuple(_d["Genes"].astype(str).tolist()),
+        # Final_Risk_score badge HTML per row, rendered once per data file instead of per lookup
+        "badges": tuple(risk_badge_html(v) for v in _d["Final_Risk_score"].tolist()) if "Final_Risk_score" in _d.columns else None,
+    }
 
-LEVEL_ORDER = ["Clinical_Importance_level","Transmissibility_level","Mobility_level","Pathogenic_level"]
-SCORE_ORDER = ["Clinial_Importance_score","Transmissbilitty_score","Mobility_score","Pathogenic_score","Final_Risk_score"]
-present_levels = [c for c in LEVEL_ORDER if c in df.columns]
-present_scores = [c for c in SCORE_ORDER if c in df.columns]
-base_cols = ["Genes"] + present_levels + present_scores
-extra_cols = [c for c in df.columns if c not in set(base_cols + ["gene_key"])]
-DISPLAY_COLS = base_cols + extra_cols
+DATA_PATH = "genes_risk.csv"
+DATA_VERSION = data_version(DATA_PATH)
+df = load_data(DATA_PATH, DATA_VERSION)
+IDX = build_indices(DATA_PATH, DATA_VERSION, df)
+CHOICES, KEY_INDEX, SCORE_ARRAYS = IDX["choices"], IDX["key_index"], IDX["score_arrays"]
+
+# WRatio also tries partial/token scorers (e.g. blaTEM -> blac); fuzz.ratio (Indel) is much cheaper and has
+# rapidfuzz's SIMD batch kernel, but only scores whole-string similarity
+SCORERS = {"WRatio": fuzz.WRatio, "ratio": fuzz.ratio}
+
+# memoized across reruns; CHOICES is read from module scope so only the queries, cutoff, scorer name and data
+# version are hashed.
+# Keys are already stripped and lowered, so processor=None skips any per-call string preprocessing.
+@st.cache_data(show_spinner=False, max_entries=10000)
+def fuzzy_topk(q_key: str, scorer: str, version: int, k: int = 5):
+    return process.extract(q_key, CHOICES, scorer=SCORERS[scorer], processor=None, limit=k)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def fuzzy_best_keys(query_keys, cutoff, scorer, version):
+    # one batched cdist call instead of extractOne per query; argmax keeps extractOne's first-best tie-break
+    if not query_keys:
+        return []
+    # pasted lists often repeat genes; score each distinct key once.
+    # An exact key always scores 100 and no other string does, so only the rest need a scan.
+    unique_keys = list(dict.fromkeys(query_keys))
+    best = {q: q for q in unique_keys if q in KEY_INDEX}
+    fuzzy_keys = [q for q in unique_keys if q not in best]
+    if fuzzy_keys:
+        scores = process.cdist(fuzzy_keys, CHOICES, scorer=SCORERS[scorer], processor=None, score_cutoff=cutoff, dtype=np.float32, workers=-1)
+        best_idx = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(fuzzy_keys)), best_idx]
+        best.update((q, CHOICES[i] if sc > 0 and sc >= cutoff else None) for q, i, sc in zip(fuzzy_keys, best_idx, best_scores))
+    return [best[q] for q in query_keys]
+
+def gather_rows(keys):
+    # positional gather through KEY_INDEX; -1 marks keys with no row, which come back as NaN rows
+    idx = np.fromiter((KEY_INDEX.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+    matched = idx >= 0
+    rows = df.iloc[idx[matched]].set_axis(np.flatnonzero(matched)).reindex(range(len(keys)))
+    return idx, matched, rows
+
+# whole bulk result memoized per (queries, mode, cutoff, scorer, data version)
+@st.cache_data(show_spinner=False, max_entries=64)
+def bulk_lookup(queries, fuzzy, cutoff, scorer, version):
+    q_keys = [q.lower() for q in queries]
+    if fuzzy:
+        best_keys = fuzzy_best_keys(q_keys, cutoff, scorer, version)
+        hit_note, miss_note = "Fuzzy", f"No fuzzy match ≥{cutoff}"
+    else:
+        best_keys = q_keys
+        hit_note, miss_note = "Exact", "No exact match"
+    # one vectorized gather for all queries instead of a dict per row
+    _, matched, bulk_df = gather_rows(best_keys)
+    bulk_df["Query"] = list(queries)
+    bulk_df["Match"] = bulk_df["Genes"].astype(object).where(matched, "")
+    bulk_df["Note"] = np.where(matched, hit_note, miss_note)
+    return bulk_df
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def df_to_csv_bytes(row_hashes, columns, _frame: pd.DataFrame) -> bytes:
+    return _frame.to_csv(index=False).encode("utf-8")
+
+def csv_bytes(frame: pd.DataFrame) -> bytes:
+    # keyed on per-row content hashes (order-sensitive) so reruns skip re-serializing an unchanged table
+    row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return df_to_csv_bytes(row_hashes, tuple(frame.columns), frame)
+
+present_levels = IDX["present_levels"]
+present_scores = IDX["present_scores"]
+DISPLAY_COLS = IDX["display_cols"]
 
 with st.sidebar:
     st.markdown("# ARG / ARM Risk Portal")
     st.caption("Levels first, then scores. Use the calculator to estimate sample-level risk indices.")
     st.write("**Columns in display order:**")
     st.code("\\n".join(DISPLAY_COLS))
+    scorer = st.selectbox("Fuzzy scorer", options=list(SCORERS), index=0, key="scorer",
+                          help="WRatio also weighs partial and token matches; ratio is much faster but only compares whole names.")
 
 tab1, tab2, tab3, tab4 = st.tabs(["🔎 Lookup", "📥 Bulk Lookup", "🧮 Risk Index Calculator", "ℹ️ About & Media"])
 
@@ -69,8 +243,15 @@ with tab1:
     st.subheader("Single Gene Lookup")
     c1, c2 = st.columns([3,1])
 
-    gene_options = df["Genes"].astype(str).tolist()
-    sel = c1.selectbox("Autocomplete", options=["— Select a gene —"] + gene_options, index=0, key="sel_single")
+    # once something is typed, only the top fuzzy suggestions are sent to the dropdown
+    typed = st.session_state.get("free_single", "").strip()
+    labels = IDX["gene_labels"]
+    suggestions = fuzzy_topk(typed.lower(), scorer, DATA_VERSION, 50) if typed else []
+    if typed:
+        options = [labels[i] for _, _, i in suggestions]
+    else:
+        options = list(labels)
+    sel = c1.selectbox("Autocomplete", options=["— Select a gene —"] + options, index=0, key="sel_single")
     q_free = c1.text_input("Or type a gene", placeholder="e.g., dfra24", key="free_single").strip()
     fuzzy = c2.checkbox("Fuzzy match", value=True, key="fuzzy_single")
 
@@ -83,31 +264,28 @@ with tab1:
     if q:
         q_key = q.lower()
         if fuzzy and (not sel or sel == "— Select a gene —"):
-            choices = df["gene_key"].tolist()
-            top = process.extract(q_key, choices, scorer=fuzz.WRatio, limit=5)
+            # the top 5 are a prefix of the dropdown's top 50 for the same text, so reuse that scan
+            top = suggestions[:5] if q_free == typed else fuzzy_topk(q_key, scorer, DATA_VERSION, 5)
             if not top:
                 st.warning("No fuzzy match found.")
             else:
-                best_key = top[0][0]
-                best = df[df["gene_key"] == best_key].iloc[0]
+                # extract returns each match's position in CHOICES, which is also its row position
+                best = df.iloc[top[0][2]]
                 st.success(f"Best match: **{best['Genes']}**")
-                if "Final_Risk_score" in df.columns:
-                    st.markdown(risk_badge_html(best["Final_Risk_score"]), unsafe_allow_html=True)
+                if IDX["badges"] is not None:
+                    st.markdown(IDX["badges"][top[0][2]], unsafe_allow_html=True)
                 st.dataframe(pd.DataFrame([best])[DISPLAY_COLS], use_container_width=True, hide_index=True)
                 with st.expander("Similar matches"):
-                    sim_rows = []
-                    for choice, score, _ in top:
-                        r = df[df["gene_key"] == choice].iloc[0]
-                        sim_rows.append({"Match": r["Genes"], "Score": score})
-                    st.dataframe(pd.DataFrame(sim_rows), use_container_width=True, hide_index=True)
+                    sim_df = pd.DataFrame({"Match": df["Genes"].iloc[[i for _, _, i in top]].to_numpy(), "Score": [sc for _, sc, _ in top]})
+                    st.dataframe(sim_df, use_container_width=True, hide_index=True)
         else:
-            hit = df[df["gene_key"] == q_key]
-            if hit.empty:
+            idx = KEY_INDEX.get(q_key)
+            if idx is None:
                 st.warning("No exact match found.")
             else:
-                row = hit.iloc[0]
-                if "Final_Risk_score" in hit.columns:
-                    st.markdown(risk_badge_html(row["Final_Risk_score"]), unsafe_allow_html=True)
+                hit = df.iloc[[idx]]
+                if IDX["badges"] is not None:
+                    st.markdown(IDX["badges"][idx], unsafe_allow_html=True)
                 st.dataframe(hit[DISPLAY_COLS], use_container_width=True, hide_index=True)
 
 # ---------- Bulk Lookup (unique keys) ----------
@@ -120,34 +298,9 @@ with tab2:
     cutoff = c2.slider("Fuzzy cutoff", min_value=50, max_value=95, value=70, step=1, key="cutoff_bulk")
     if bulk_text:
         queries = [x.strip() for x in bulk_text.splitlines() if x.strip()]
-        out_rows = []
-        choices = df["gene_key"].tolist()
-        for q in queries:
-            q_key = q.lower()
-            if fuzzy_bulk:
-                match = process.extractOne(q_key, choices, scorer=fuzz.WRatio, score_cutoff=cutoff)
-                if not match:
-                    out_rows.append({"Query": q, "Match": "", "Note": f"No fuzzy match ≥{cutoff}"})
-                else:
-                    best_key = match[0]
-                    row = df[df["gene_key"] == best_key].iloc[0].to_dict()
-                    row["Query"] = q
-                    row["Match"] = row.get("Genes", "")
-                    row["Note"] = "Fuzzy"
-                    out_rows.append(row)
-            else:
-                hit = df[df["gene_key"] == q_key]
-                if hit.empty:
-                    out_rows.append({"Query": q, "Match": "", "Note": "No exact match"})
-                else:
-                    row = hit.iloc[0].to_dict()
-                    row["Query"] = q
-                    row["Match"] = row.get("Genes", "")
-                    row["Note"] = "Exact"
-                    out_rows.append(row)
-        bulk_df = pd.DataFrame(out_rows)
+        bulk_df = bulk_lookup(tuple(queries), fuzzy_bulk, cutoff, scorer, DATA_VERSION)
         st.dataframe(bulk_df, use_container_width=True, hide_index=True)
-        st.download_button("Download results (CSV)", bulk_df.to_csv(index=False).encode("utf-8"), "bulk_lookup.csv", "text/csv", key="bulk_download")
+        st.download_button("Download results (CSV)", csv_bytes(bulk_df), "bulk_lookup.csv", "text/csv", key="bulk_download")
 
 # ---------- Risk Index Calculator (unique keys) ----------
 with tab3:
@@ -171,49 +324,47 @@ with tab3:
         calc_text = st.text_area("Genes and Abundances", height=140, placeholder="geneA, 10\ngeneB, 3.5", key="calc_text")
 
         uploaded = st.file_uploader("...or upload a CSV with columns: Genes, Abundance", type=["csv"], key="calc_upload")
-        input_rows = []
+        inp = pd.DataFrame(columns=["Genes", "Abundance"])
 
         if calc_text:
-            for line in calc_text.splitlines():
-                if "," in line:
-                    g, a = line.split(",", 1)
-                    g = g.strip()
-                    try:
-                        a = float(a)
-                    except:
-                        a = None
-                    input_rows.append({"Genes": g, "Abundance": a})
+            # split every "Gene, Abundance" line at its first comma in one vectorized pass; lines without a comma are ignored
+            lines = pd.Series(calc_text.splitlines(), dtype=object)
+            lines = lines[lines.str.contains(",", regex=False)]
+            if not lines.empty:
+                parts = lines.str.split(",", n=1, expand=True)
+                inp = pd.DataFrame({"Genes": parts[0].str.strip(), "Abundance": pd.to_numeric(parts[1].str.strip(), errors="coerce")}).reset_index(drop=True)
         elif uploaded is not None:
             tmp = pd.read_csv(uploaded)
             colmap = {c.lower(): c for c in tmp.columns}
             gcol = colmap.get("genes") or colmap.get("gene")
             acol = colmap.get("abundance")
             if gcol and acol:
-                for _, r in tmp.iterrows():
-                    input_rows.append({"Genes": str(r[gcol]), "Abundance": float(r[acol])})
+                inp = tmp[[gcol, acol]].set_axis(["Genes", "Abundance"], axis=1)
+                inp["Genes"] = inp["Genes"].fillna("").astype(str)
+                inp["Abundance"] = pd.to_numeric(inp["Abundance"], errors="coerce")
             else:
                 st.error("Uploaded CSV must contain 'Genes' and 'Abundance' columns.")
 
-        if input_rows:
-            inp = pd.DataFrame(input_rows)
+        if not inp.empty:
             inp["query_key"] = inp["Genes"].str.strip().str.lower()
             if fuzzy_calc:
-                choices = df["gene_key"].tolist()
-                matches = []
-                for q in inp["query_key"]:
-                    match = process.extractOne(q, choices, scorer=fuzz.WRatio, score_cutoff=cutoff_calc)
-                    matches.append(match[0] if match else None)
-                inp["match_key"] = matches
-                joined = inp.merge(df, left_on="match_key", right_on="gene_key", how="left", suffixes=("_q",""))
+                inp["match_key"] = fuzzy_best_keys(inp["query_key"].tolist(), cutoff_calc, scorer, DATA_VERSION)
+                match_keys = inp["match_key"]
             else:
-                joined = inp.merge(df, left_on="query_key", right_on="gene_key", how="left", suffixes=("_q",""))
+                match_keys = inp["query_key"]
+
+            idx, matched, hits = gather_rows(match_keys)
+            joined = pd.concat([inp.rename(columns={"Genes": "Genes_q"}), hits], axis=1)
 
-            if chosen_score not in joined.columns:
+            if chosen_score not in SCORE_ARRAYS:
                 st.error(f"Selected score column '{chosen_score}' is not present in your dataset.")
             else:
-                joined["Risk_Score"] = pd.to_numeric(joined[chosen_score], errors="coerce")
-                joined["Product"] = joined["Abundance"] * joined["Risk_Score"]
-                total = joined["Product"].sum(skipna=True)
+                risk = np.full(len(inp), np.nan)
+                risk[matched] = SCORE_ARRAYS[chosen_score][idx[matched]]
+                product = inp["Abundance"].to_numpy(dtype=np.float64, na_value=np.nan) * risk
+                total = np.nansum(product)
+                joined["Risk_Score"] = risk
+                joined["Product"] = product
 
                 show_cols = ["Genes_q","Genes","Abundance","Risk_Score","Product"] + present_levels + present_scores
                 show_cols = [c for c in show_cols if c in joined.columns]
@@ -225,7 +376,7 @@ with tab3:
                     st.markdown(risk_badge_html(min(max(total, 0.0), 1.0)), unsafe_allow_html=True)
                 else:
                     st.metric("Risk Index", f"{total:.6g}")
-                st.download_button("Download matched table (CSV)", joined.to_csv(index=False).encode("utf-8"), "risk_index_breakdown.csv", "text/csv", key="calc_download")
+                st.download_button("Download matched table (CSV)", csv_bytes(joined), "risk_index_breakdown.csv", "text/csv", key="calc_download")
         else:
             st.info("Enter some data above to compute the Risk Index.")
 